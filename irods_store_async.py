@@ -0,0 +1,350 @@
+"""
+asyncio front end for the iRODS store driver, for Python 3 services that
+run an event loop instead of eventlet. Copy it next to irods_store.py in
+the glance_store `_drivers` folder.
+
+python-irodsclient only offers blocking calls, so the iRODS work still
+runs on threads: a bounded executor runs the blocking calls, and
+coroutines wait for a free session on the event loop rather than on a
+thread. Each call holds a slot for each pooled session it may lease at
+once: an image stream one per session it reads over
+(irods_store_download_threads of them when it reads ahead), an upload
+irods_store_upload_threads when it writes parts or chunks in parallel. A
+stream served from the image cache takes no slot, unless it started a
+cache fill, whose sessions it holds slots for until the fill ends. The
+sessions of background replication threads are set aside, so
+irods_store_pool_max_size bounds the sessions of all concurrent calls,
+while the executor only needs to be as large as the number of chunks in
+flight.
+
+The synchronous glance_store interface stays with irods_store.Store;
+AsyncStore wraps a configured instance of it:
+
+    store = AsyncStore(irods_store.Store(conf))
+    store.configure()
+    data, size = await store.get(location)
+    async for chunk in data:
+        ...
+
+Read a stream to the end or close it with aclose(), in a finally block
+if need be; a stream dropped half read is closed and gives its slots back
+only once it is garbage collected, which may be much later.
+"""
+
+import asyncio
+import functools
+from concurrent import futures
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+class AsyncSessionPool(object):
+    """
+    Admits coroutines to the sessions of an IrodsSessionPool. A coroutine
+    takes a slot for each session it will lease, waiting on the event loop
+    while all are taken, so the blocking pool never has to make an
+    executor thread wait. reserved sessions are left to background work
+    leasing from the pool on its own threads
+    """
+
+    def __init__(self, pool, executor, reserved=0):
+        self.pool = pool
+        self.executor = executor
+        self.size = max(1, pool.max_size - reserved)
+        self._slots = None
+        self._admission = None
+
+    @property
+    def slots(self):
+        # created on first use, inside the event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        return self._slots
+
+    @property
+    def admission(self):
+        if self._admission is None:
+            self._admission = asyncio.Lock()
+        return self._admission
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking call on the executor
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Run a blocking call that leases a session, once a slot is free
+        """
+        return await self.call_leasing(1, func, *args, **kwargs)
+
+    async def call_leasing(self, count, func, *args, **kwargs):
+        """
+        Run a blocking call that leases up to count sessions at once, once
+        as many slots are free
+        """
+        count = min(count, self.size)
+        await self.acquire(count)
+        try:
+            return await self.run(func, *args, **kwargs)
+        finally:
+            self.release_slots(count)
+
+    async def acquire(self, count=1):
+        """
+        Take count slots, for a stream leasing several sessions at once.
+        Coroutines taking several slots do so one at a time, so that two
+        of them never each hold part of the slots the other waits for
+        """
+        if count <= 1:
+            if count:
+                await self.slots.acquire()
+            return
+        taken = 0
+        async with self.admission:
+            try:
+                while taken < count:
+                    await self.slots.acquire()
+                    taken += 1
+            except BaseException:
+                self.release_slots(taken)
+                raise
+
+    def release_slots(self, count=1):
+        for i in range(count):
+            self.slots.release()
+
+    async def lease(self):
+        """
+        Take a slot and lease a session for it; hand both back with
+        release()
+        """
+        await self.slots.acquire()
+        try:
+            return await self.run(self.pool.get)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def release(self, sess, discard=False):
+        try:
+            await self.run(self.pool.put, sess, discard)
+        finally:
+            self.slots.release()
+
+
+class AsyncChunkedFile(object):
+    """
+    Async iterator over image data. Each chunk is read on the executor
+    from the blocking iterator the driver returned; the slots taken for
+    the stream are given back when it ends or is closed, or when it is
+    garbage collected without being closed
+    """
+
+    def __init__(self, chunks, sessions, slots=1):
+        self._closed = True
+        self.chunks = chunks
+        self.sessions = sessions
+        self.slots = slots
+        self._loop = asyncio.get_event_loop()
+        self._iter = iter(chunks)
+        self._closed = False
+
+    def _give_back(self):
+        """
+        Returns a callable, safe to call from any thread, giving the slots
+        back once the driver's stream no longer leases the sessions they
+        count: a cache fill the stream started may outlive it
+        """
+        loop = self._loop
+        sessions = self.sessions
+        slots = self.slots
+        when_released = getattr(self.chunks, 'when_released', None)
+
+        def release():
+            try:
+                loop.call_soon_threadsafe(sessions.release_slots, slots)
+            except RuntimeError:
+                # the event loop is closed
+                pass
+
+        def give_back(future=None):
+            if when_released is None:
+                release()
+            else:
+                when_released(release)
+        return give_back
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self.sessions.run(next, self._iter, None)
+        except BaseException:
+            await self.aclose()
+            raise
+        if chunk is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._iter, 'close', None)
+            if close is not None:
+                await self.sessions.run(close)
+        finally:
+            if getattr(self.chunks, 'when_released', None) is None:
+                self.sessions.release_slots(self.slots)
+            else:
+                self._give_back()()
+
+    def __del__(self):
+        if self._closed:
+            return
+        self._closed = True
+        release = self._give_back()
+        # the blocking iterator is closed on the executor, as aclose()
+        # would, since closing it returns its sessions to the pool
+        close = getattr(self._iter, 'close', None)
+        if close is None:
+            release()
+            return
+        try:
+            self.sessions.executor.submit(close).add_done_callback(release)
+        except RuntimeError:
+            # the executor is shut down
+            release()
+
+
+class _SyncReader(object):
+    """
+    File-like object the blocking upload reads from, fed by the read()
+    coroutine of an async image source running on the event loop
+    """
+
+    def __init__(self, image_file, loop):
+        self.image_file = image_file
+        self.loop = loop
+
+    def read(self, size=-1):
+        return asyncio.run_coroutine_threadsafe(
+            self.image_file.read(size), self.loop).result()
+
+
+class AsyncStore(object):
+    """
+    Coroutine versions of the get, get_size, get_sizes, add and delete
+    calls of a configured irods_store.Store
+    """
+
+    def __init__(self, store, max_workers=32):
+        self.store = store
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._sessions = {}
+
+    @property
+    def sessions(self):
+        return self.sessions_for(self.store.irods_manager)
+
+    def sessions_for(self, manager):
+        """
+        The AsyncSessionPool of the pool of an endpoint's IrodsManager
+        """
+        sessions = self._sessions.get(manager.name)
+        if sessions is None or sessions.pool is not manager.pool:
+            reserved = 0
+            if manager.replication is not None:
+                reserved = manager.replication.threads
+            sessions = AsyncSessionPool(manager.pool, self.executor,
+                                        reserved)
+            self._sessions[manager.name] = sessions
+        return sessions
+
+    def configure(self, re_raise_bsc=False):
+        """
+        Configure the wrapped store. It blocks, on iRODS too unless
+        irods_store_lazy_connect is set, so call it before serving
+        """
+        self.store.configure(re_raise_bsc=re_raise_bsc)
+
+    async def get(self, location, offset=0, chunk_size=None, context=None):
+        """
+        Returns an AsyncChunkedFile over the image, or the range of it
+        starting at offset and spanning chunk_size bytes, and its size,
+        as irods_store.Store.get does. The stream keeps a slot for each
+        session it reads over until it is read to the end or closed with
+        aclose()
+        """
+        sessions = self.sessions_for(self.store.route(location))
+        chunks, size = await sessions.call(
+            self.store.get, location, offset=offset, chunk_size=chunk_size,
+            context=context)
+        # the stream leases nothing until it is read
+        slots = min(chunks.max_sessions(), sessions.size)
+        try:
+            await sessions.acquire(slots)
+        except BaseException:
+            await sessions.run(_close, chunks)
+            raise
+        return AsyncChunkedFile(chunks, sessions, slots), size
+
+    async def get_size(self, location, context=None):
+        sessions = self.sessions_for(self.store.route(location))
+        return await sessions.call(self.store.get_size, location,
+                                   context=context)
+
+    async def get_sizes(self, locations, context=None):
+        return await self.sessions.call(self.store.get_sizes, locations,
+                                        context=context)
+
+    async def delete(self, location, context=None):
+        sessions = self.sessions_for(self.store.route(location))
+        return await sessions.call(self.store.delete, location,
+                                   context=context)
+
+    async def add(self, image_id, image_file, image_size, hashing_algo=None,
+                  context=None, verifier=None):
+        """
+        Stores the image like irods_store.Store.add and returns the same
+        tuple. image_file is either a file-like object or an object with
+        a read(size) coroutine, such as asyncio.StreamReader
+        """
+        if asyncio.iscoroutinefunction(getattr(image_file, 'read', None)):
+            image_file = _SyncReader(image_file, asyncio.get_event_loop())
+        manager = self.store.place(image_id)
+        sessions = self.sessions_for(manager)
+        return await sessions.call_leasing(
+            manager.max_upload_sessions(), self.store.add, image_id,
+            image_file, image_size, hashing_algo=hashing_algo,
+            context=context, verifier=verifier)
+
+    async def add_from_location(self, image_id, location, checksum=None,
+                                hashing_algo=None, multihash=None,
+                                context=None):
+        """
+        Copies the image at location on the iRODS server like
+        irods_store.Store.add_from_location and returns the same tuple.
+        The copy leases one session at a time
+        """
+        sessions = self.sessions_for(self.store.route(location))
+        return await sessions.call(
+            self.store.add_from_location, image_id, location,
+            checksum=checksum, hashing_algo=hashing_algo,
+            multihash=multihash, context=context)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,452 @@
+"""
+Tests of the iRODS store driver against the in-process fake iRODS of
+tools/fake_irods.py. Run them from the top of the tree with
+
+    python -m unittest discover tests
+"""
+
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir,
+                                'tools'))
+
+from glance_store import location  # noqa: E402
+from oslo_config import cfg  # noqa: E402
+
+import fake_irods  # noqa: E402
+import irods_store  # noqa: E402
+
+ZONE = 'testZone'
+USER = 'tester'
+PATH = '/%s/home/%s/images' % (ZONE, USER)
+MB = 1 << 20
+
+
+def run_within(test, seconds, func, *args):
+    """
+    Call func on a thread and fail the test if it has not returned after
+    seconds, rather than hanging the run. Returns what func returned
+    """
+    result = {}
+
+    def call():
+        try:
+            result['value'] = func(*args)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=call)
+    thread.daemon = True
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        test.fail('%s still running after %s seconds' %
+                  (getattr(func, '__name__', func), seconds))
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+class StoreTestCase(unittest.TestCase):
+    """
+    Runs a Store configured with the options of the test case against a
+    fresh fake grid
+    """
+
+    options = {}
+
+    def setUp(self):
+        self.grid = fake_irods.Grid(seed=0)
+        self.grid.add_collection(PATH)
+        fake_irods.install(irods_store, self.grid)
+        cfg.CONF([], project='glance')
+        overrides = {'irods_store_host': 'localhost',
+                     'irods_store_zone': ZONE,
+                     'irods_store_path': PATH,
+                     'irods_store_user': USER,
+                     'irods_store_password': 'secret'}
+        overrides.update(self.options)
+        for name, value in overrides.items():
+            cfg.CONF.set_override(name, value)
+            self.addCleanup(cfg.CONF.clear_override, name)
+        self.store = irods_store.Store(cfg.CONF)
+        self.store.configure_add()
+        for manager in self.store.irods_managers.values():
+            self.addCleanup(manager.close)
+        self.manager = self.store.irods_manager
+        self.assertTrue(self.manager.wait_ready(5))
+
+    def add(self, image_id, data):
+        """
+        Add the image and check what add returns; returns its location
+        """
+        uri, size, checksum = self.store.add(image_id, io.BytesIO(data),
+                                             len(data))[:3]
+        self.assertEqual(len(data), size)
+        self.assertEqual(hashlib.md5(data).hexdigest(), checksum)
+        return location.Location('irods', irods_store.StoreLocation,
+                                 cfg.CONF, uri=uri)
+
+    def read(self, image_location, offset=0, length=None):
+        chunks, size = self.store.get(image_location, offset=offset,
+                                      chunk_size=length)
+        return b''.join(chunks)
+
+    def stored(self, image_id):
+        return bytes(self.grid.objects[PATH + '/' + image_id]['data'])
+
+    def assertSameData(self, expected, actual):
+        """
+        Compare digests, so a failure does not print megabytes of data
+        """
+        self.assertEqual((len(expected), hashlib.md5(expected).hexdigest()),
+                         (len(actual), hashlib.md5(actual).hexdigest()))
+
+    def assertNoLeases(self):
+        self.assertEqual({}, self.manager.pool._checked)
+
+
+class ParallelUploadTest(StoreTestCase):
+
+    options = {'irods_store_upload_threads': 4,
+               'irods_store_upload_part_size': MB,
+               'irods_store_checksum_mode': 'both',
+               'irods_store_pool_checkout_timeout': 5}
+
+    def test_parts_are_written_in_place(self):
+        data = os.urandom(5 * MB + 123)
+        image_location = self.add('image', data)
+        self.assertSameData(data, self.stored('image'))
+        self.assertEqual(hashlib.md5(data).hexdigest(),
+                         self.grid.objects[PATH + '/image']['checksum'])
+        self.assertSameData(data, self.read(image_location))
+        self.assertNoLeases()
+
+    def test_logical_locking_falls_back_to_one_stream(self):
+        self.grid.logical_locking = True
+        for image_id in ('first', 'second'):
+            data = os.urandom(3 * MB)
+            self.add(image_id, data)
+            self.assertSameData(data, self.stored(image_id))
+        self.assertFalse(self.manager.parallel_writes)
+        self.assertEqual(set(), self.grid.locked)
+        self.assertNoLeases()
+
+
+class ParallelUploadPoolExhaustionTest(StoreTestCase):
+
+    options = dict(ParallelUploadTest.options,
+                   irods_store_pool_max_size=2)
+
+    def test_upload_with_fewer_sessions_than_threads(self):
+        data = os.urandom(5 * MB)
+        run_within(self, 4, self.add, 'image', data)
+        self.assertSameData(data, self.stored('image'))
+        self.assertNoLeases()
+
+    def test_concurrent_uploads_share_the_pool(self):
+        images = dict(('image-%d' % i, os.urandom(3 * MB))
+                      for i in range(6))
+
+        def add_all():
+            threads = [threading.Thread(target=self.add, args=item)
+                       for item in images.items()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        run_within(self, 10, add_all)
+        for image_id, data in images.items():
+            self.assertSameData(data, self.stored(image_id))
+        self.assertNoLeases()
+
+
+class ParallelDownloadTest(StoreTestCase):
+
+    options = {'irods_store_download_threads': 4,
+               'irods_store_chunk_size': 256 * 1024,
+               'irods_store_download_buffer_size': MB,
+               'irods_store_pool_checkout_timeout': 3}
+
+    def setUp(self):
+        super(ParallelDownloadTest, self).setUp()
+        self.data = os.urandom(6 * MB + 17)
+        self.location = self.add('image', self.data)
+
+    def test_whole_image(self):
+        self.assertSameData(self.data, self.read(self.location))
+        self.assertNoLeases()
+
+    def test_ranges(self):
+        for offset, length in ((0, 1), (5, 300000), (MB - 3, 2 * MB),
+                               (len(self.data) - 10, 10)):
+            self.assertSameData(self.data[offset:offset + length],
+                                self.read(self.location, offset, length))
+        self.assertSameData(self.data[2 * MB:],
+                            self.read(self.location, 2 * MB))
+        self.assertNoLeases()
+
+
+class ParallelDownloadPoolExhaustionTest(ParallelDownloadTest):
+
+    options = dict(ParallelDownloadTest.options,
+                   irods_store_pool_max_size=2,
+                   irods_store_read_retries=0)
+
+    def test_concurrent_reads_share_the_pool(self):
+        results = []
+
+        def read_all():
+            threads = [threading.Thread(
+                target=lambda: results.append(self.read(self.location)))
+                for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        run_within(self, 20, read_all)
+        self.assertEqual(4, len(results))
+        for data in results:
+            self.assertSameData(self.data, data)
+        self.assertNoLeases()
+
+    def test_read_while_the_pool_is_leased(self):
+        sess = self.manager.pool.get()
+        try:
+            self.assertSameData(
+                self.data, run_within(self, 4, self.read, self.location))
+        finally:
+            self.manager.pool.put(sess)
+        self.assertNoLeases()
+
+
+class ResumableUploadTest(StoreTestCase):
+
+    options = {'irods_store_upload_checkpoint_interval': MB,
+               'irods_store_chunk_size': 256 * 1024}
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.checkpoint_dir)
+        self.options = dict(self.options,
+                            irods_store_upload_checkpoint_dir=self.
+                            checkpoint_dir)
+        super(ResumableUploadTest, self).setUp()
+        self.data = os.urandom(5 * MB + 100)
+        self.failing = False
+        original = fake_irods.FakeConnection.write_file
+
+        def write_file(conn, desc, string):
+            if self.failing and \
+                    self.grid.bytes_written + len(string) > 3 * MB:
+                conn.session.broken = True
+                raise fake_irods.NetworkException('connection reset')
+            return original(conn, desc, string)
+        fake_irods.FakeConnection.write_file = write_file
+        self.addCleanup(setattr, fake_irods.FakeConnection, 'write_file',
+                        original)
+
+    def interrupted_add(self):
+        """
+        Add the image with writes failing past 3MB; returns the offset of
+        the checkpoint left behind
+        """
+        self.failing = True
+        self.assertRaises(irods_store.exceptions.StorageWriteDenied,
+                          self.store.add, 'image', io.BytesIO(self.data),
+                          len(self.data))
+        self.failing = False
+        self.assertNoLeases()
+        files = glob.glob(os.path.join(self.checkpoint_dir, '*.json'))
+        self.assertEqual(1, len(files))
+        with open(files[0]) as f:
+            return json.load(f)['offset']
+
+    def test_resume_after_network_failure(self):
+        offset = self.interrupted_add()
+        self.assertTrue(0 < offset <= 3 * MB)
+        # the replica was never closed, so the catalog knows nothing of it
+        self.assertEqual(0, self.grid.objects[PATH + '/image']['size'])
+        written = self.grid.bytes_written
+        image_location = self.add('image', self.data)
+        self.assertEqual(len(self.data) - offset,
+                         self.grid.bytes_written - written)
+        self.assertSameData(self.data, self.stored('image'))
+        self.assertSameData(self.data, self.read(image_location))
+        self.assertEqual([], os.listdir(self.checkpoint_dir))
+        self.assertNoLeases()
+
+    def test_short_replica_starts_over(self):
+        offset = self.interrupted_add()
+        del self.grid.objects[PATH + '/image']['data'][offset - 1:]
+        written = self.grid.bytes_written
+        self.add('image', self.data)
+        self.assertEqual(len(self.data), self.grid.bytes_written - written)
+        self.assertSameData(self.data, self.stored('image'))
+        self.assertEqual([], os.listdir(self.checkpoint_dir))
+
+    def test_different_data_starts_over(self):
+        self.interrupted_add()
+        other = os.urandom(len(self.data))
+        self.assertRaises(irods_store.exceptions.StorageWriteDenied,
+                          self.store.add, 'image', io.BytesIO(other),
+                          len(other))
+        self.assertEqual([], os.listdir(self.checkpoint_dir))
+        self.add('image', other)
+        self.assertSameData(other, self.stored('image'))
+        self.assertNoLeases()
+
+
+@unittest.skipIf(irods_store.zstandard is None, 'needs zstandard')
+class CompressionTest(StoreTestCase):
+
+    options = {'irods_store_compression': 'zstd',
+               'irods_store_compression_frame_size': 64 * 1024,
+               'irods_store_chunk_size': 100000}
+
+    def test_ranges_span_frames(self):
+        # compressible, but not evenly
+        data = b''.join(os.urandom(1000) + b'\0' * 9000 for i in range(100))
+        image_location = self.add('image', data)
+        stored = sum(len(obj['data']) for obj in self.grid.objects.values())
+        self.assertTrue(stored < len(data) / 2)
+        self.assertSameData(data, self.read(image_location))
+        for offset, length in ((0, 1), (65535, 2), (70000, 300000),
+                               (len(data) - 10, 10)):
+            self.assertSameData(data[offset:offset + length],
+                                self.read(image_location, offset, length))
+        self.assertNoLeases()
+
+
+@unittest.skipIf(irods_store.lz4 is None, 'needs lz4')
+class LZ4CompressionTest(CompressionTest):
+
+    options = dict(CompressionTest.options, irods_store_compression='lz4')
+
+
+class DedupTest(StoreTestCase):
+
+    options = {'irods_store_dedup': True,
+               'irods_store_dedup_chunk_size': 64 * 1024,
+               'irods_store_upload_threads': 4,
+               'irods_store_download_threads': 4,
+               'irods_store_chunk_size': 100000}
+
+    def test_shared_chunks_are_stored_once(self):
+        base = os.urandom(2 * MB)
+        images = {'first': base + os.urandom(1000),
+                  'second': os.urandom(1000) + base}
+        locations = dict((image_id, self.add(image_id, data))
+                         for image_id, data in images.items())
+        stored = sum(len(obj['data']) for obj in self.grid.objects.values())
+        self.assertTrue(stored < 3 * MB)
+        for image_id, data in images.items():
+            self.assertSameData(data, self.read(locations[image_id]))
+            self.assertSameData(data[MB - 5:MB + 70000],
+                                self.read(locations[image_id], MB - 5,
+                                          70005))
+
+        self.store.delete(locations['first'])
+        self.assertSameData(images['second'],
+                            self.read(locations['second']))
+        self.assertNoLeases()
+
+
+class ImageCacheTest(StoreTestCase):
+
+    options = {'irods_store_chunk_size': 256 * 1024}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.options = dict(self.options,
+                            irods_store_cache_dir=self.cache_dir)
+        super(ImageCacheTest, self).setUp()
+        self.data = os.urandom(3 * MB + 5)
+        self.location = self.add('image', self.data)
+
+    def cached_files(self):
+        return [name for name in os.listdir(self.cache_dir)
+                if not name.endswith('.part')]
+
+    def fill(self):
+        self.assertSameData(self.data, self.read(self.location))
+        deadline = time.time() + 5
+        while not self.cached_files() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, len(self.cached_files()))
+        return os.path.join(self.cache_dir, self.cached_files()[0])
+
+    def test_hits_are_served_from_the_cache(self):
+        self.fill()
+        read = self.grid.bytes_read
+        self.assertSameData(self.data, self.read(self.location))
+        self.assertSameData(self.data[MB:MB + 1000],
+                            self.read(self.location, MB, 1000))
+        self.assertEqual(read, self.grid.bytes_read)
+        self.assertNoLeases()
+
+    def test_truncated_entry_fails_and_is_evicted(self):
+        path = self.fill()
+        with open(path, 'r+b') as f:
+            f.truncate(MB)
+        self.assertRaises(IOError, self.read, self.location)
+        self.assertEqual([], self.cached_files())
+        # the next read goes to iRODS, and caches the image again
+        self.fill()
+        self.assertSameData(self.data, self.read(self.location))
+        self.assertNoLeases()
+
+
+class DeleteTest(StoreTestCase):
+
+    def setUp(self):
+        super(DeleteTest, self).setUp()
+        self.location = self.add('image', os.urandom(1000))
+
+    def fail_lookups(self, error):
+        def get(manager, path):
+            raise error
+        original = fake_irods.FakeDataObjectManager.get
+        fake_irods.FakeDataObjectManager.get = get
+        self.addCleanup(setattr, fake_irods.FakeDataObjectManager, 'get',
+                        original)
+
+    def test_delete(self):
+        self.store.delete(self.location)
+        self.assertNotIn(PATH + '/image', self.grid.objects)
+        self.assertRaises(irods_store.exceptions.NotFound,
+                          self.store.delete, self.location)
+        self.assertNoLeases()
+
+    def test_outage_is_not_reported_as_not_found(self):
+        for error in (fake_irods.NetworkException('connection reset'),
+                      Exception('CAT_INVALID_AUTHENTICATION')):
+            self.fail_lookups(error)
+            try:
+                self.store.delete(self.location)
+            except irods_store.exceptions.NotFound:
+                self.fail('%r reported as NotFound' % error)
+            except Exception:
+                pass
+            else:
+                self.fail('delete succeeded despite %r' % error)
+        self.assertIn(PATH + '/image', self.grid.objects)
+        self.assertNoLeases()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests of the asyncio front end, against the fake iRODS. They need Python
+3, as irods_store_async does
+"""
+
+import gc
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from test_irods_store import MB, StoreTestCase
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    import irods_store_async
+else:
+    asyncio = None
+
+
+@unittest.skipIf(asyncio is None, 'irods_store_async needs Python 3')
+class AsyncStoreTestCase(StoreTestCase):
+
+    def setUp(self):
+        super(AsyncStoreTestCase, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.async_store = irods_store_async.AsyncStore(self.store)
+        self.addCleanup(self.async_store.close)
+        self.sessions = self.async_store.sessions
+
+    def run_loop(self, coroutine, timeout=10):
+        return self.loop.run_until_complete(
+            asyncio.wait_for(coroutine, timeout))
+
+    def free_slots(self):
+        # slots given back from other threads land on the next iteration
+        self.run_loop(asyncio.sleep(0.01))
+        return self.sessions.slots._value
+
+    def read_all(self, stream):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.run_loop(stream.__anext__()))
+            except StopAsyncIteration:
+                return b''.join(chunks)
+
+
+class AsyncUploadTest(AsyncStoreTestCase):
+
+    options = {'irods_store_upload_threads': 4,
+               'irods_store_upload_part_size': MB,
+               'irods_store_pool_max_size': 2,
+               'irods_store_pool_checkout_timeout': 5}
+
+    def test_upload_takes_a_slot_per_session(self):
+        images = dict(('image-%d' % i, os.urandom(3 * MB))
+                      for i in range(4))
+        self.run_loop(asyncio.gather(*[
+            self.async_store.add(image_id, io.BytesIO(data), len(data))
+            for image_id, data in images.items()]))
+        for image_id, data in images.items():
+            self.assertSameData(data, self.stored(image_id))
+        self.assertEqual(2, self.free_slots())
+        self.assertNoLeases()
+
+
+class AsyncDownloadTest(AsyncStoreTestCase):
+
+    options = {'irods_store_download_threads': 3,
+               'irods_store_chunk_size': 256 * 1024,
+               'irods_store_pool_max_size': 4,
+               'irods_store_pool_checkout_timeout': 5}
+
+    def setUp(self):
+        super(AsyncDownloadTest, self).setUp()
+        self.data = os.urandom(4 * MB)
+        self.location = self.add('image', self.data)
+
+    def test_read_ahead_takes_a_slot_per_session(self):
+        stream, size = self.run_loop(self.async_store.get(self.location))
+        self.assertEqual(3, stream.slots)
+        self.assertSameData(self.data, self.read_all(stream))
+        self.assertEqual(4, self.free_slots())
+        self.assertNoLeases()
+
+    def test_dropped_stream_gives_its_slots_back(self):
+        stream, size = self.run_loop(self.async_store.get(self.location))
+        self.run_loop(stream.__anext__())
+        self.assertEqual(1, self.free_slots())
+        del stream
+        gc.collect()
+        deadline = time.time() + 5
+        while self.free_slots() < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(4, self.free_slots())
+        self.assertNoLeases()
+
+
+class AsyncCacheTest(AsyncStoreTestCase):
+
+    options = dict(AsyncDownloadTest.options, irods_store_download_threads=2)
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.options = dict(self.options, irods_store_cache_dir=cache_dir)
+        super(AsyncCacheTest, self).setUp()
+        self.data = os.urandom(4 * MB)
+        self.location = self.add('image', self.data)
+
+    def test_fill_holds_its_slots_until_it_ends(self):
+        stream, size = self.run_loop(self.async_store.get(self.location))
+        self.assertEqual(2, stream.slots)
+        self.assertSameData(self.data, self.read_all(stream))
+        deadline = time.time() + 5
+        while self.free_slots() < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(4, self.free_slots())
+
+        stream, size = self.run_loop(self.async_store.get(self.location))
+        self.assertEqual(0, stream.slots)
+        self.assertSameData(self.data, self.read_all(stream))
+        self.assertEqual(4, self.free_slots())
+        self.assertNoLeases()
+
+
+if __name__ == '__main__':
+    unittest.main()
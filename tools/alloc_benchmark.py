@@ -0,0 +1,152 @@
+"""
+Microbenchmark of the memory the driver allocates per GB it moves, for
+downloads and uploads through the python-irodsclient file object
+("buffered") and through DirectDataObject ("direct"), and for splitting
+uploads into parts. The iRODS connection is a stub that hands back a
+preallocated buffer and discards writes, so only the allocations of the
+driver and of the client library's file object are counted.
+
+Each chunk is traced with tracemalloc on its own, and the peaks are
+added up, so a buffer that is allocated and freed within a chunk counts
+once per chunk. The stub returns a new bytes object for every read, as
+the real connection does, so those count too. Needs Python 3 for
+tracemalloc, and the driver's dependencies; run from the repository
+root:
+
+    python3 tools/alloc_benchmark.py --size 33554432 --chunk-size 4194304
+
+On Python 3.8 this reports, in MB allocated per GB: read 2048 buffered
+and 1024 direct, write 1024 buffered and 0 direct, and parts 0 from
+16MiB chunks and 1024 from 4MiB chunks.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from irods.data_object import iRODSDataObjectFileRaw  # noqa: E402
+
+import irods_store  # noqa: E402
+
+
+class StubConnection(object):
+    """
+    Stands in for an iRODS connection holding one open data object
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def read_file(self, desc, size):
+        # a new object per read, like a message off the wire
+        return bytes(memoryview(self.payload)[:size])
+
+    def write_file(self, desc, string):
+        return len(string)
+
+    def seek_file(self, desc, offset, whence):
+        return offset
+
+    def close_file(self, desc, options):
+        pass
+
+    def release(self):
+        pass
+
+
+def open_stub(chunk_size, direct):
+    raw = iRODSDataObjectFileRaw(StubConnection(b'\0' * chunk_size), 3, {})
+    fp = io.BufferedRandom(raw)
+    if direct:
+        return irods_store.DirectDataObject(fp)
+    return fp
+
+
+def traced(func, *args):
+    """
+    Run func and return its result and the peak bytes it allocated
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_read(size, chunk_size, direct):
+    fp = open_stub(chunk_size, direct)
+    allocated = 0
+    for i in range(size // chunk_size):
+        chunk, peak = traced(fp.read, chunk_size)
+        assert len(chunk) == chunk_size
+        allocated += peak
+        del chunk
+    return allocated
+
+
+def bench_write(size, chunk_size, direct):
+    fp = open_stub(chunk_size, direct)
+    buf = os.urandom(chunk_size)
+    allocated = 0
+    for i in range(size // chunk_size):
+        allocated += traced(fp.write, buf)[1]
+    return allocated
+
+
+def bench_parts(size, chunk_size, part_size):
+    data = os.urandom(size)
+    chunks = [data[i:i + chunk_size] for i in range(0, size, chunk_size)]
+    parts = irods_store._read_parts(iter(chunks), part_size)
+    allocated = 0
+    while True:
+        part, peak = traced(next, parts, None)
+        if part is None:
+            return allocated
+        allocated += peak
+
+
+def report(name, size, allocated, seconds):
+    per_gb = allocated * float(1 << 30) / size
+    print('%-28s %12.1f MB allocated per GB  %8.1f MB/s' %
+          (name, per_gb / (1 << 20), size / float(1 << 20) / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=32 << 20,
+                        help='bytes moved per case')
+    parser.add_argument('--chunk-size', type=int, default=4 << 20)
+    parser.add_argument('--part-size', type=int, default=16 << 20)
+    args = parser.parse_args()
+    if tracemalloc is None:
+        parser.error('tracemalloc is needed; run this with Python 3')
+
+    for direct in (False, True):
+        mode = 'direct' if direct else 'buffered'
+        for name, bench in (('read', bench_read), ('write', bench_write)):
+            started = time.time()
+            allocated = bench(args.size, args.chunk_size, direct)
+            report('%s %s' % (name, mode), args.size, allocated,
+                   time.time() - started)
+
+    for chunk_size in (args.part_size, args.chunk_size):
+        started = time.time()
+        allocated = bench_parts(args.size, chunk_size, args.part_size)
+        report('parts from %d byte chunks' % chunk_size, args.size,
+               allocated, time.time() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Benchmark of the iRODS store driver against the in-process fake iRODS of
+fake_irods.py, so it runs offline on any box with the driver's
+dependencies installed. Images are added, read whole, read from random
+offsets, read in small ranges, sized and deleted through Store, from a
+number of concurrent threads, and every read is checked against the MD5
+of the data it should return. Each case reports its throughput and p50
+and p99 latency; the run reports its peak memory and the iRODS sessions
+it opened. Driver options can be set with --set, for example
+
+    python tools/benchmark.py --images 8 --size 67108864 --latency 0.002 \\
+        --bandwidth 104857600 --set irods_store_download_threads=4
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import io
+import os
+import resource
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from glance_store import location  # noqa: E402
+from oslo_config import cfg  # noqa: E402
+
+import fake_irods  # noqa: E402
+import irods_store  # noqa: E402
+
+ZONE = 'benchZone'
+USER = 'bench'
+PATH = '/%s/home/%s/images' % (ZONE, USER)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Case(object):
+    """
+    Runs one operation over a list of arguments from concurrent threads
+    and collects per-operation latency and bytes moved
+    """
+
+    def __init__(self, name, operation, args, concurrency):
+        self.name = name
+        self.operation = operation
+        self.args = list(args)
+        self.concurrency = concurrency
+        self.latencies = []
+        self.nbytes = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def run(self):
+        pending = list(reversed(self.args))
+
+        def work():
+            while True:
+                with self._lock:
+                    if not pending:
+                        return
+                    arg = pending.pop()
+                started = time.time()
+                try:
+                    nbytes = self.operation(arg)
+                except Exception as e:
+                    with self._lock:
+                        self.errors += 1
+                    print('%s failed: %s' % (self.name, e), file=sys.stderr)
+                    continue
+                elapsed = time.time() - started
+                with self._lock:
+                    self.latencies.append(elapsed)
+                    self.nbytes += nbytes or 0
+
+        started = time.time()
+        threads = [threading.Thread(target=work)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.seconds = time.time() - started
+        return self
+
+    def report(self):
+        rate = self.nbytes / float(1 << 20) / self.seconds \
+            if self.seconds else 0.0
+        print('%-14s %6d ops %4d errors %9.1f MB/s  p50 %8.1f ms  '
+              'p99 %8.1f ms' %
+              (self.name, len(self.latencies), self.errors, rate,
+               percentile(self.latencies, 0.5) * 1000,
+               percentile(self.latencies, 0.99) * 1000))
+
+
+def configure(args):
+    conf = cfg.CONF
+    conf([], project='glance')
+    overrides = {'irods_store_host': 'localhost',
+                 'irods_store_zone': ZONE,
+                 'irods_store_path': PATH,
+                 'irods_store_user': USER,
+                 'irods_store_password': 'bench'}
+    opts = dict((opt.name, opt) for opt in irods_store.irods_opts)
+    for setting in args.set:
+        name, value = setting.split('=', 1)
+        overrides[name] = opts[name].type(value)
+    for name, value in overrides.items():
+        conf.set_override(name, value)
+    store = irods_store.Store(conf)
+    store.configure_add()
+    store.irods_manager.wait_ready()
+    return conf, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--size', type=int, default=32 << 20,
+                        help='bytes per image')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='seconds per request to the fake iRODS')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='bytes per second per connection, 0 unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='chance of a network error per read or write')
+    parser.add_argument('--ranges', type=int, default=16,
+                        help='offset and small reads per image')
+    parser.add_argument('--small-size', type=int, default=64 << 10,
+                        help='bytes per small read')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the peak memory traced by '
+                             'tracemalloc, which slows the run down')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='OPTION=VALUE', help='driver option')
+    args = parser.parse_args()
+
+    trace_memory = args.trace_memory and tracemalloc is not None
+    if trace_memory:
+        tracemalloc.start()
+
+    grid = fake_irods.Grid(latency=args.latency, bandwidth=args.bandwidth,
+                           seed=args.seed)
+    grid.add_collection(PATH)
+    fake_irods.install(irods_store, grid)
+    conf, store = configure(args)
+    # errors only once the store is up, so that configuring it succeeds
+    grid.error_rate = args.error_rate
+
+    data = os.urandom(args.size)
+    data_digest = hashlib.md5(data).digest()
+    image_ids = ['image-%04d' % i for i in range(args.images)]
+    # filled in by add, as the data object may not be named after the id
+    locations = {}
+    rand = grid.random
+
+    def add(image_id):
+        uri, nbytes = store.add(image_id, io.BytesIO(data), len(data))[:2]
+        locations[image_id] = location.Location(
+            'irods', irods_store.StoreLocation, conf, uri=uri)
+        return nbytes
+
+    def digest(offset, length):
+        if offset == 0 and length == len(data):
+            return data_digest
+        return hashlib.md5(data[offset:offset + length]).digest()
+
+    def get(arg):
+        image_id, offset, length = arg
+        chunks, size = store.get(locations[image_id], offset=offset,
+                                 chunk_size=length)
+        nbytes = 0
+        md5 = hashlib.md5()
+        for chunk in chunks:
+            nbytes += len(chunk)
+            md5.update(chunk)
+        expected = size - offset if length is None else length
+        if nbytes != expected:
+            raise IOError('read %d bytes of %d' % (nbytes, expected))
+        if md5.digest() != digest(offset, expected):
+            raise IOError('read the wrong data at offset %d' % offset)
+        return nbytes
+
+    def ranges(length):
+        for image_id in image_ids:
+            for i in range(args.ranges):
+                offset = rand.randrange(0, max(1, args.size - (length or 0)))
+                yield image_id, offset, length
+
+    cases = [
+        Case('add', add, image_ids, args.concurrency),
+        Case('get', get, [(image_id, 0, None) for image_id in image_ids],
+             args.concurrency),
+        Case('get offset', get, ranges(None), args.concurrency),
+        Case('get small', get, ranges(args.small_size), args.concurrency),
+        Case('get_size', lambda image_id: store.get_size(
+            locations[image_id]) and 0, image_ids, args.concurrency),
+        Case('delete', lambda image_id: store.delete(locations[image_id]),
+             image_ids, args.concurrency),
+    ]
+    for case in cases:
+        case.run().report()
+
+    counters = grid.counters()
+    print('iRODS sessions: %(sessions_opened)d opened, at most '
+          '%(peak_sessions)d open at once, %(sessions_open)d still open; '
+          '%(requests)d requests, %(errors)d injected errors' % counters)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print('peak RSS %.1f MB' % (usage.ru_maxrss / 1024.0))
+    if trace_memory:
+        print('peak traced memory %.1f MB' %
+              (tracemalloc.get_traced_memory()[1] / float(1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Removes the chunks of deduplicated images that no manifest lists any
+more, which deleting images leaves behind. Chunks younger than the grace
+period are kept, as are all chunks while an image is being uploaded.
+Reads the iRODS options from the Glance configuration; run from the
+repository root, or with the driver installed in glance_store:
+
+    python tools/collect_chunks.py --config-file /etc/glance/glance-api.conf
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from oslo_config import cfg  # noqa: E402
+
+try:
+    from glance_store._drivers import irods_store
+except ImportError:
+    import irods_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='Glance configuration file')
+    parser.add_argument('--grace', type=int, default=24 * 3600,
+                        help='seconds for which unused chunks are kept')
+    args = parser.parse_args()
+
+    conf = cfg.CONF
+    conf([], project='glance', default_config_files=args.config_file)
+    conf.set_override('irods_store_lazy_connect', False)
+    conf.set_override('irods_store_replication_threads', 0)
+    store = irods_store.Store(conf)
+    store.configure_add()
+    removed = store.irods_manager.collect_chunks(args.grace)
+    print('removed %d unused chunks' % removed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+"""
+In-process stand-in for python-irodsclient's iRODSSession, for running
+the driver without an iRODS grid. Data objects live in memory in a Grid.
+Open data objects are the client library's own raw file objects over a
+fake connection, so reads and writes go through the same calls they would
+make on the wire. Every request to the fake server can be given a latency,
+transfers a per-connection bandwidth, and reads and writes a rate of
+injected network errors. With logical_locking, a data object open for
+writing cannot be opened for writing again until it is closed, as on
+iRODS 4.2.9 and later. As on iRODS, the size in the catalog only catches
+up with what was written when the data object is closed cleanly.
+
+    grid = fake_irods.Grid(latency=0.002, bandwidth=100 * units.Mi)
+    fake_irods.install(irods_store, grid)
+"""
+
+import datetime
+import fnmatch
+import hashlib
+import io
+import itertools
+import random
+import threading
+import time
+
+from irods.data_object import iRODSDataObjectFileRaw
+from irods.exception import (CollectionDoesNotExist, DataObjectDoesNotExist,
+                             NetworkException)
+import irods.keywords as kw
+from irods.meta import iRODSMeta
+from irods.models import Collection, DataObject
+
+
+class Grid(object):
+    """
+    State of the fake iRODS server, and its counters
+    """
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0, seed=None,
+                 resource='demoResc', logical_locking=False):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.resource = resource
+        self.logical_locking = logical_locking
+        self.locked = set()
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.objects = {}
+        self.collections = set()
+        self.sessions_opened = 0
+        self.sessions_open = 0
+        self.peak_sessions = 0
+        self.requests = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add_collection(self, path):
+        while path and path != '/':
+            self.collections.add(path)
+            path = path.rsplit('/', 1)[0]
+
+    def request(self, nbytes=0, fallible=False):
+        """
+        Account for one request moving nbytes, sleeping for the latency
+        and transfer time, and maybe failing it
+        """
+        with self.lock:
+            self.requests += 1
+            fail = fallible and self.error_rate and \
+                self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes / float(self.bandwidth)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise NetworkException("injected network error")
+
+    def counters(self):
+        with self.lock:
+            return {'sessions_opened': self.sessions_opened,
+                    'sessions_open': self.sessions_open,
+                    'peak_sessions': self.peak_sessions,
+                    'requests': self.requests,
+                    'errors': self.errors,
+                    'bytes_read': self.bytes_read,
+                    'bytes_written': self.bytes_written}
+
+
+def _catalog_size(obj):
+    """
+    The size the catalog reports; objects added to a grid by hand have
+    none of their own
+    """
+    return obj.get('size', len(obj['data']))
+
+
+class FakeConnection(object):
+    """
+    The calls iRODSDataObjectFileRaw makes on a connection
+    """
+
+    def __init__(self, session, path, options):
+        self.session = session
+        self.grid = session.grid
+        self.path = path
+        self.options = options or {}
+        self.position = 0
+        self.locking = False
+        self.written = False
+
+    def read_file(self, desc, size):
+        self.session.check()
+        with self.grid.lock:
+            data = bytes(self.grid.objects[self.path]['data'][
+                self.position:self.position + size])
+        try:
+            self.grid.request(len(data), fallible=True)
+        except NetworkException:
+            self.session.broken = True
+            raise
+        self.position += len(data)
+        with self.grid.lock:
+            self.grid.bytes_read += len(data)
+        return data or None
+
+    def write_file(self, desc, string):
+        self.session.check()
+        try:
+            self.grid.request(len(string), fallible=True)
+        except NetworkException:
+            self.session.broken = True
+            raise
+        with self.grid.lock:
+            obj = self.grid.objects[self.path]
+            end = self.position + len(string)
+            if len(obj['data']) < end:
+                obj['data'].extend(b'\0' * (end - len(obj['data'])))
+            obj['data'][self.position:end] = string
+            obj['modify_time'] = datetime.datetime.utcnow()
+            self.grid.bytes_written += len(string)
+        self.position = end
+        self.written = True
+        return len(string)
+
+    def seek_file(self, desc, offset, whence):
+        self.session.check()
+        self.grid.request()
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        else:
+            with self.grid.lock:
+                size = len(self.grid.objects[self.path]['data'])
+            self.position = size + offset
+        return self.position
+
+    def close_file(self, desc, options):
+        self.grid.request()
+        with self.grid.lock:
+            if self.locking:
+                self.grid.locked.discard(self.path)
+            if self.session.broken:
+                # the server never hears of the close
+                return
+            if self.written:
+                obj = self.grid.objects[self.path]
+                obj['size'] = len(obj['data'])
+            if kw.REG_CHKSUM_KW in self.options:
+                obj = self.grid.objects[self.path]
+                obj['checksum'] = hashlib.md5(bytes(obj['data'])).hexdigest()
+
+    def release(self):
+        pass
+
+
+class FakeReplica(object):
+    def __init__(self, number, resource_name):
+        self.number = number
+        self.status = '1'
+        self.resource_name = resource_name
+
+
+class FakeDataObject(object):
+    def __init__(self, manager, path, obj):
+        self.manager = manager
+        self.path = path
+        self.name = path.rsplit('/', 1)[1]
+        self.size = _catalog_size(obj)
+        self.checksum = obj.get('checksum')
+        self.modify_time = obj['modify_time']
+        self.replicas = [FakeReplica(number, resource) for number, resource
+                         in enumerate(obj['replicas'])]
+
+    def open(self, mode='r', options=None):
+        return self.manager.open(self.path, mode, options)
+
+    def unlink(self, force=False, options=None):
+        self.manager.unlink(self.path, force, options)
+
+
+class FakeDataObjectManager(object):
+    def __init__(self, session):
+        self.session = session
+        self.grid = session.grid
+        self._descriptors = itertools.count(3)
+
+    def get(self, path):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            return FakeDataObject(self, path, self.grid.objects[path])
+
+    def create(self, path, resource=None, options=None):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path in self.grid.objects:
+                raise Exception("OVERWRITE_WITHOUT_FORCE_FLAG")
+            if path.rsplit('/', 1)[0] not in self.grid.collections:
+                raise CollectionDoesNotExist()
+            self.grid.objects[path] = {
+                'data': bytearray(), 'size': 0, 'checksum': None,
+                'modify_time': datetime.datetime.utcnow(),
+                'replicas': [resource or self.grid.resource]}
+        return self.get(path)
+
+    def open(self, path, mode, options=None):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            resource = (options or {}).get(kw.RESC_NAME_KW)
+            if resource and \
+                    resource not in self.grid.objects[path]['replicas']:
+                raise Exception("SYS_REPLICA_DOES_NOT_EXIST")
+            locking = self.grid.logical_locking and mode != 'r'
+            if locking:
+                if path in self.grid.locked:
+                    raise Exception("LOCKED_DATA_OBJECT_ACCESS")
+                self.grid.locked.add(path)
+        conn = FakeConnection(self.session, path, options)
+        conn.locking = locking
+        raw = iRODSDataObjectFileRaw(conn, next(self._descriptors), options)
+        return io.BufferedRandom(raw)
+
+    def unlink(self, path, force=False, options=None):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            del self.grid.objects[path]
+
+    def move(self, src_path, dest_path):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if dest_path in self.grid.objects:
+                raise Exception("OVERWRITE_WITHOUT_FORCE_FLAG")
+            self.grid.objects[dest_path] = self.grid.objects.pop(src_path)
+
+    def truncate(self, path, size):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            obj = self.grid.objects[path]
+            del obj['data'][size:]
+            obj['size'] = len(obj['data'])
+
+    def copy(self, src_path, dest_path, options=None):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if src_path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            if dest_path in self.grid.objects:
+                raise Exception("OVERWRITE_WITHOUT_FORCE_FLAG")
+            obj = self.grid.objects[src_path]
+            checksum = obj.get('checksum')
+            if kw.REG_CHKSUM_KW in (options or {}):
+                checksum = hashlib.md5(bytes(obj['data'])).hexdigest()
+            self.grid.objects[dest_path] = {
+                'data': bytearray(obj['data']),
+                'size': len(obj['data']),
+                'checksum': checksum,
+                'modify_time': datetime.datetime.utcnow(),
+                'replicas': [(options or {}).get(kw.DEST_RESC_NAME_KW) or
+                             self.grid.resource]}
+
+    def replicate(self, path, options=None):
+        self.session.check()
+        resource = (options or {}).get(kw.DEST_RESC_NAME_KW)
+        with self.grid.lock:
+            obj = self.grid.objects[path]
+            size = len(obj['data'])
+        self.grid.request(size)
+        with self.grid.lock:
+            if resource and resource not in obj['replicas']:
+                obj['replicas'].append(resource)
+
+
+class FakeCollection(object):
+    def __init__(self, path):
+        self.path = path
+        self.name = path.rsplit('/', 1)[1]
+
+
+class FakeCollectionManager(object):
+    def __init__(self, session):
+        self.session = session
+        self.grid = session.grid
+
+    def get(self, path):
+        self.session.check()
+        self.grid.request()
+        if path not in self.grid.collections:
+            raise CollectionDoesNotExist()
+        return FakeCollection(path)
+
+    def exists(self, path):
+        try:
+            self.get(path)
+        except CollectionDoesNotExist:
+            return False
+        return True
+
+    def create(self, path):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path in self.grid.collections:
+                raise Exception("CATALOG_ALREADY_HAS_ITEM_BY_THAT_NAME")
+            if path.rsplit('/', 1)[0] not in self.grid.collections:
+                raise CollectionDoesNotExist()
+            self.grid.collections.add(path)
+        return FakeCollection(path)
+
+
+class FakeMetadataManager(object):
+    """
+    AVUs of data objects, one value per attribute
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.grid = session.grid
+
+    def get(self, model_cls, path):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            meta = self.grid.objects[path].get('meta', {})
+            return [iRODSMeta(name, value) for name, value in meta.items()]
+
+    def set(self, model_cls, path, meta):
+        self.session.check()
+        self.grid.request()
+        with self.grid.lock:
+            if path not in self.grid.objects:
+                raise DataObjectDoesNotExist()
+            self.grid.objects[path].setdefault('meta', {})[meta.name] = \
+                meta.value
+
+
+class FakeResultSet(list):
+    continue_index = 0
+
+
+class FakeQuery(object):
+    """
+    The GenQueries the driver runs: data objects of one collection, or of
+    the collections whose name is like a pattern, a page of rows per
+    replica at a time
+    """
+
+    def __init__(self, session, collection=None, limit=500, start=0):
+        self.session = session
+        self.collection = collection
+        self._limit = limit
+        self._start = start
+
+    def filter(self, criterion):
+        collection = criterion.value.strip("'")
+        if criterion.op == 'like':
+            collection = collection.replace('%', '*')
+        return FakeQuery(self.session, collection, self._limit, self._start)
+
+    def order_by(self, column, order='asc'):
+        return self
+
+    def limit(self, limit):
+        return FakeQuery(self.session, self.collection, limit, self._start)
+
+    def continue_index(self, index):
+        return FakeQuery(self.session, self.collection, self._limit, index)
+
+    def close(self):
+        pass
+
+    def execute(self):
+        grid = self.session.grid
+        grid.request()
+        rows = []
+        with grid.lock:
+            for path in sorted(grid.objects):
+                collection, name = path.rsplit('/', 1)
+                if not fnmatch.fnmatchcase(collection, self.collection):
+                    continue
+                obj = grid.objects[path]
+                for resource in obj['replicas']:
+                    rows.append({Collection.name: collection,
+                                 DataObject.name: name,
+                                 DataObject.size: _catalog_size(obj),
+                                 DataObject.checksum: obj.get('checksum'),
+                                 DataObject.modify_time: obj['modify_time'],
+                                 DataObject.resource_name: resource})
+        page = FakeResultSet(rows[self._start:self._start + self._limit])
+        if self._start + self._limit < len(rows):
+            page.continue_index = self._start + self._limit
+        return page
+
+
+class FakeSession(object):
+    """
+    Takes the arguments of iRODSSession; the grid comes from install()
+    """
+
+    grid = None
+
+    def __init__(self, *args, **kwargs):
+        grid = self.grid
+        grid.request()
+        with grid.lock:
+            grid.sessions_opened += 1
+            grid.sessions_open += 1
+            grid.peak_sessions = max(grid.peak_sessions, grid.sessions_open)
+        self.host = kwargs.get('host')
+        self.broken = False
+        self.closed = False
+        self.numThreads = 0
+        self.collections = FakeCollectionManager(self)
+        self.data_objects = FakeDataObjectManager(self)
+        self.metadata = FakeMetadataManager(self)
+
+    def check(self):
+        if self.broken:
+            raise NetworkException("connection reset")
+
+    def query(self, *columns):
+        return FakeQuery(self)
+
+    def cleanup(self):
+        if not self.closed:
+            self.closed = True
+            with self.grid.lock:
+                self.grid.sessions_open -= 1
+
+
+def install(module, grid):
+    """
+    Make module, the driver, open sessions on grid
+    """
+    session_class = type('FakeSession', (FakeSession,), {'grid': grid})
+    module.iRODSSession = session_class
+    return session_class